@@ -4,7 +4,9 @@ Telegram Video Downloader Bot
 Uses yt-dlp to download videos from 1000+ websites
 """
 
+import asyncio
 import logging
+import signal
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -12,13 +14,16 @@ from telegram.ext import (
     CallbackQueryHandler,
     filters
 )
-from config.settings import BOT_TOKEN
+from config.settings import BOT_TOKEN, SHUTDOWN_GRACE_PERIOD
 from handlers.message_handlers import (
     start_command,
     help_command,
     cancel_command,
     handle_message,
-    handle_quality_selection
+    handle_quality_selection,
+    resume_pending_jobs,
+    jobs,
+    prefetcher
 )
 
 # Configure logging
@@ -28,6 +33,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Running graceful shutdown, set by the first stop signal
+_shutdown_task = None
+
+
+async def post_init(application: Application):
+    """Install shutdown signal handlers and resume unfinished downloads"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, request_shutdown, application)
+    
+    await resume_pending_jobs(application.bot)
+
+
+def request_shutdown(application: Application):
+    """Drain on the first stop signal, stop immediately on the next one"""
+    global _shutdown_task
+    
+    if _shutdown_task is None:
+        # Refuse new jobs right away, before the drain gets to run
+        jobs.draining = True
+        _shutdown_task = asyncio.create_task(graceful_shutdown(application))
+        return
+    
+    logger.warning("Stop signal received again, stopping immediately")
+    _shutdown_task.cancel()
+    prefetcher.discard_all()
+    jobs.interrupt()
+    application.stop_running()
+
+
+async def graceful_shutdown(application: Application):
+    """Stop accepting new jobs, drain active ones and stop the bot"""
+    logger.info("Shutting down gracefully...")
+    
+    # Stop fetching updates so no new jobs come in
+    if application.updater.running:
+        await application.updater.stop()
+    
+    prefetcher.discard_all()
+    await jobs.drain(SHUTDOWN_GRACE_PERIOD)
+    
+    application.stop_running()
+
 
 def main():
     """Start the bot"""
@@ -37,7 +85,7 @@ def main():
         return
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
     
     # Register command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -52,7 +100,8 @@ def main():
     
     # Start the bot
     logger.info("Starting bot...")
-    application.run_polling()
+    # Signals are handled by graceful_shutdown instead of stopping right away
+    application.run_polling(stop_signals=None)
 
 
 if __name__ == '__main__':
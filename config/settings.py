@@ -34,12 +34,35 @@ YTDLP_OPTIONS = {
     'no_warnings': True,
     'extract_flat': False,
     'nocheckcertificate': True,
+    # Resume .part files left by an interrupted run instead of starting over
+    'continuedl': True,
     # Better Instagram and social media support
     'http_headers': {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     }
 }
 
+# Failure handling settings
+NEGATIVE_CACHE_TTL = 300  # Seconds a failed URL is answered from cache
+CIRCUIT_BREAKER_THRESHOLD = 5  # Consecutive failures before an extractor is disabled
+CIRCUIT_BREAKER_COOLDOWN = 120  # Seconds before a disabled extractor is probed again
+CIRCUIT_BREAKER_STATE_FILE = DOWNLOAD_DIR / 'circuit_breakers.json'  # Exported breaker state for monitoring
+
+# Every download gets its own subdirectory here so concurrent jobs never share files
+JOBS_DIR = DOWNLOAD_DIR / 'jobs'
+
+# Speculative prefetch settings
+# Start downloading the most likely quality while the user is still choosing
+SPECULATIVE_PREFETCH = os.getenv('SPECULATIVE_PREFETCH', 'false').lower() == 'true'
+PREFETCH_DEFAULT_CHOICE = 'quality_best'  # Used until a site has selection statistics
+PREFETCH_MAX_BYTES = 5 * 1024 * 1024  # Bytes fetched before stopping to wait for the user's choice
+PREFETCH_TIMEOUT = 300  # Seconds a stopped or finished prefetch waits for the user's choice
+
+# Shutdown and restart settings
+SHUTDOWN_GRACE_PERIOD = 30  # Seconds active uploads get to finish on shutdown
+JOB_JOURNAL_FILE = DOWNLOAD_DIR / 'pending_jobs.json'  # Unfinished downloads to resume on start
+MAX_RESUME_ATTEMPTS = 3  # Crashed runs a download survives before it is given up on
+
 # Create downloads directory if it doesn't exist
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
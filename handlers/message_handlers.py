@@ -1,14 +1,41 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember, Message
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest
 from utils.localization import i18n
-from utils.downloader import VideoDownloader
-from config.settings import REQUIRED_CHANNELS
+from utils.downloader import VideoDownloader, QUALITY_CHOICES
+from utils.prefetch import SpeculativePrefetcher, PrefetchJob
+from utils.jobs import JobManager, DownloadJob
+from config.settings import (
+    REQUIRED_CHANNELS,
+    JOBS_DIR,
+    SPECULATIVE_PREFETCH,
+    PREFETCH_DEFAULT_CHOICE,
+    PREFETCH_MAX_BYTES,
+    PREFETCH_TIMEOUT,
+    JOB_JOURNAL_FILE,
+    MAX_RESUME_ATTEMPTS,
+)
+from typing import Optional
+import asyncio
+import logging
 import os
 
 
+logger = logging.getLogger(__name__)
+
 # Initialize downloader
 downloader = VideoDownloader()
+prefetcher = SpeculativePrefetcher(
+    downloader,
+    JOBS_DIR,
+    PREFETCH_DEFAULT_CHOICE,
+    PREFETCH_MAX_BYTES,
+    PREFETCH_TIMEOUT
+)
+jobs = JobManager(JOB_JOURNAL_FILE, JOBS_DIR, MAX_RESUME_ATTEMPTS)
+
+# Keep references to resumed jobs so they aren't garbage collected
+_resume_tasks = set()
 
 
 async def check_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -84,8 +111,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /cancel command"""
-    # Clear user data
+    # Clear user data and stop any speculative download
     context.user_data.clear()
+    prefetcher.discard(update.effective_user.id)
     await update.message.reply_text(i18n.get('operation_cancelled'))
 
 
@@ -95,6 +123,11 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_channel_membership(update, context):
         return
     
+    # Don't start new jobs while shutting down
+    if jobs.draining:
+        await update.message.reply_text(i18n.get('bot_restarting'))
+        return
+    
     url = update.message.text.strip()
     
     # Basic URL validation
@@ -105,20 +138,25 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Save URL to user context
     context.user_data['last_url'] = url
     
+    # A new link makes any speculative download for the previous one useless
+    prefetcher.discard(update.effective_user.id)
+    
     # Send processing message
     processing_msg = await update.message.reply_text(i18n.get('extracting_info'))
     
-    # Extract video info
-    info = downloader.extract_info(url)
+    # Extract video info in a worker thread so the event loop stays responsive
+    info = await asyncio.to_thread(downloader.extract_info, url)
     
     if not info:
-        await processing_msg.edit_text(i18n.get('unsupported_site'))
+        error_key, error = downloader.get_failure(url)
+        await processing_msg.edit_text(i18n.get(error_key, error=error))
         return
     
     # Get video title and duration
     title = info.get('title', 'Unknown')
     duration = info.get('duration', 0)
     context.user_data['video_title'] = title
+    context.user_data['video_site'] = info.get('extractor_key')
     
     # Format duration
     duration_str = ""
@@ -140,6 +178,10 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_text = f"📹 {title}{duration_str}\n\n{i18n.get('select_format', formats='')}"
     
     await processing_msg.edit_text(message_text, reply_markup=reply_markup)
+    
+    # Start downloading the most likely choice while the user decides
+    if SPECULATIVE_PREFETCH:
+        prefetcher.start(update.effective_user.id, url, context.user_data['video_site'])
 
 
 async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -156,71 +198,92 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
     
     await query.answer()
     
+    # Don't start new downloads while shutting down
+    if jobs.draining:
+        await query.edit_message_text(i18n.get('bot_restarting'))
+        return
+    
     url = context.user_data.get('last_url')
     
     if not url:
         await query.edit_message_text(i18n.get('no_url_saved'))
         return
     
+    # Determine which quality to download
+    quality_choice = query.data
+    
+    if quality_choice not in QUALITY_CHOICES:
+        await query.edit_message_text(i18n.get('invalid_format'))
+        return
+    
     # Update message to show downloading status
     await query.edit_message_text(i18n.get('downloading'))
     
-    # Determine which quality to download
-    quality_choice = query.data
+    prefetcher.record_choice(context.user_data.get('video_site'), quality_choice)
+    
+    job = jobs.begin(
+        query.message.chat_id,
+        url,
+        quality_choice,
+        context.user_data.get('video_title', '')
+    )
+    
+    # Reuse the speculative download if it guessed right
+    prefetch = prefetcher.take(update.effective_user.id, url, quality_choice, job.progress_hook)
+    
+    await run_job(context.bot, job, query.message, prefetch)
+
+
+async def run_job(bot, job: DownloadJob, status_message: Message, prefetch: Optional[PrefetchJob] = None):
+    """
+    Download a job, send the file to its chat and clean up
+    
+    Args:
+        bot: Telegram bot used for uploading
+        job: Tracked download job
+        status_message: Message that shows the job's progress
+        prefetch: Promoted speculative download for the job (optional)
+    """
+    filepath = None
     
     try:
-        if quality_choice == 'quality_best':
-            filepath = downloader.download_best(url)
-        elif quality_choice == 'quality_medium':
-            filepath = downloader.download_medium(url)
-        elif quality_choice == 'quality_low':
-            filepath = downloader.download_low(url)
-        elif quality_choice == 'quality_audio':
-            filepath = downloader.download_audio(url)
-        else:
-            await query.edit_message_text(i18n.get('invalid_format'))
+        if prefetch:
+            # The prefetch's files now belong to this job
+            jobs.adopt_directory(job, prefetch.directory)
+            filepath = await prefetch.task
+        
+        if not prefetch or (not filepath and prefetch.cancelled.is_set()):
+            filepath = await asyncio.to_thread(
+                downloader.download_choice, job.choice, job.url, job.progress_hook, job.directory
+            )
+        
+        # Interrupted by shutdown, keep partial files to resume on next start
+        if job.cancelled.is_set():
+            await status_message.edit_text(i18n.get('download_interrupted'))
             return
         
         if not filepath:
-            await query.edit_message_text(i18n.get('file_too_large'))
+            await status_message.edit_text(i18n.get('file_too_large'))
             return
         
         # Check if file exists and get size
         if not os.path.exists(filepath):
-            await query.edit_message_text(i18n.get('error_occurred', error='فایل دانلود نشد'))
+            await status_message.edit_text(i18n.get('error_occurred', error='فایل دانلود نشد'))
             return
         
-        file_size = os.path.getsize(filepath)
-        file_size_mb = file_size / (1024 * 1024)
-        
         # Upload file to Telegram
-        await query.edit_message_text(i18n.get('uploading'))
-        
-        # Send file based on type
-        if filepath.endswith('.mp3'):
-            with open(filepath, 'rb') as audio_file:
-                await context.bot.send_audio(
-                    chat_id=query.message.chat_id,
-                    audio=audio_file,
-                    title=context.user_data.get('video_title', 'Audio'),
-                    caption=f"🎵 {context.user_data.get('video_title', '')}\n\n📦 حجم: {file_size_mb:.1f} MB"
-                )
-        else:
-            with open(filepath, 'rb') as video_file:
-                # Send as video with proper width/height to preserve aspect ratio
-                await context.bot.send_video(
-                    chat_id=query.message.chat_id,
-                    video=video_file,
-                    caption=f"📹 {context.user_data.get('video_title', '')}\n\n📦 حجم: {file_size_mb:.1f} MB",
-                    supports_streaming=True,
-                    width=None,  # Let Telegram detect
-                    height=None  # Let Telegram detect
-                )
+        await status_message.edit_text(i18n.get('uploading'))
+        
+        if not await job.upload(send_file(bot, job.chat_id, filepath, job.title)):
+            await status_message.edit_text(i18n.get('download_interrupted'))
+            return
+        
+        job.completed = True
         
         # Delete the processing message and send success message
-        await query.message.delete()
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
+        await status_message.delete()
+        await bot.send_message(
+            chat_id=job.chat_id,
             text=i18n.get('download_complete')
         )
         
@@ -230,12 +293,80 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
     except Exception as e:
         error_msg = str(e)
         if "file is too big" in error_msg.lower():
-            await query.edit_message_text(i18n.get('file_too_large'))
+            await status_message.edit_text(i18n.get('file_too_large'))
         else:
-            await query.edit_message_text(i18n.get('error_occurred', error=error_msg))
+            await status_message.edit_text(i18n.get('error_occurred', error=error_msg))
         
-        if 'filepath' in locals() and filepath:
+        if filepath:
             downloader.cleanup_file(filepath)
+    
+    finally:
+        jobs.end(job)
+
+
+async def send_file(bot, chat_id: int, filepath: str, title: str):
+    """Send a downloaded file to a chat"""
+    file_size = os.path.getsize(filepath)
+    file_size_mb = file_size / (1024 * 1024)
+    
+    # Send file based on type
+    if filepath.endswith('.mp3'):
+        with open(filepath, 'rb') as audio_file:
+            await bot.send_audio(
+                chat_id=chat_id,
+                audio=audio_file,
+                title=title or 'Audio',
+                caption=f"🎵 {title}\n\n📦 حجم: {file_size_mb:.1f} MB"
+            )
+    else:
+        with open(filepath, 'rb') as video_file:
+            # Send as video with proper width/height to preserve aspect ratio
+            await bot.send_video(
+                chat_id=chat_id,
+                video=video_file,
+                caption=f"📹 {title}\n\n📦 حجم: {file_size_mb:.1f} MB",
+                supports_streaming=True,
+                width=None,  # Let Telegram detect
+                height=None  # Let Telegram detect
+            )
+
+
+async def resume_pending_jobs(bot):
+    """Resume downloads left unfinished by the previous run"""
+    resumed, abandoned = jobs.resume()
+    
+    for job in abandoned:
+        try:
+            await bot.send_message(
+                chat_id=job.chat_id,
+                text=i18n.get('resume_failed', title=job.title)
+            )
+        except Exception as e:
+            logger.error(f"Error notifying chat {job.chat_id} about abandoned download: {e}")
+    
+    for job in resumed:
+        task = asyncio.create_task(resume_job(bot, job))
+        _resume_tasks.add(task)
+        task.add_done_callback(_resume_tasks.discard)
+
+
+async def resume_job(bot, job: DownloadJob):
+    """Continue an unfinished download from its partial files"""
+    try:
+        status_message = await bot.send_message(
+            chat_id=job.chat_id,
+            text=i18n.get('resuming_download', title=job.title)
+        )
+    except Exception as e:
+        logger.error(f"Error resuming download of {job.url}: {e}")
+        jobs.end(job)
+        return
+    
+    # Nobody awaits this task, so errors (e.g. from reporting a failure) are logged here
+    try:
+        await run_job(bot, job, status_message)
+    except Exception as e:
+        logger.error(f"Error in resumed download of {job.url}: {e}")
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
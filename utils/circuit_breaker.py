@@ -0,0 +1,194 @@
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class NegativeCache:
+    """Remember recently failed URLs so retries are answered instantly"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[Tuple[str, str]]:
+        """
+        Get cached failure for a URL
+
+        Args:
+            url: Video URL
+
+        Returns:
+            Tuple of (locale key, error message) or None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if not entry:
+                return None
+
+            expires_at, error_key, error = entry
+            if time.time() >= expires_at:
+                del self._entries[url]
+                return None
+
+            return error_key, error
+
+    def add(self, url: str, error_key: str, error: str):
+        """Cache a failure for a URL"""
+        with self._lock:
+            self._entries[url] = (time.time() + self.ttl, error_key, error)
+
+            # Drop expired entries so the cache doesn't grow without bound
+            now = time.time()
+            for cached_url in [u for u, e in self._entries.items() if e[0] <= now]:
+                del self._entries[cached_url]
+
+
+class CircuitBreaker:
+    """Stop calling an extractor after repeated failures"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, threshold: int, cooldown: float,
+                 on_change: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.on_change = on_change
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.total_failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """
+        Check whether a request may be sent to the extractor
+
+        Once the cooldown has passed an open breaker lets exactly one
+        probe through; its result decides whether the breaker closes.
+
+        Returns:
+            True if the request may proceed, False if it should be rejected
+        """
+        changed = False
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probing = False
+                changed = True
+
+            allowed = self.state == self.HALF_OPEN and not self._probing
+            if allowed:
+                self._probing = True
+
+        if changed:
+            logger.info(f"Circuit breaker for {self.name} is half-open, probing")
+            self._notify()
+        return allowed
+
+    def record_success(self):
+        """Record a successful request and close the breaker"""
+        with self._lock:
+            changed = self.state != self.CLOSED
+            had_failures = self.failures > 0
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+        if changed:
+            logger.info(f"Circuit breaker for {self.name} closed")
+        if changed or had_failures:
+            self._notify()
+
+    def record_failure(self, error: str):
+        """Record a failed request and open the breaker if needed"""
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = error
+            self._probing = False
+
+            changed = self.state != self.OPEN and (
+                self.state == self.HALF_OPEN or self.failures >= self.threshold
+            )
+            if changed:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+        if changed:
+            logger.warning(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+
+        # Export every failure so the monitored counts stay current
+        self._notify()
+
+    def to_dict(self) -> Dict:
+        """Get breaker state as a JSON serializable dictionary"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'total_failures': self.total_failures,
+                'opened_at': self.opened_at,
+                'last_error': self.last_error,
+            }
+
+    def _notify(self):
+        if self.on_change:
+            self.on_change()
+
+
+class CircuitBreakerRegistry:
+    """Keep one circuit breaker per yt-dlp extractor (per host for generic sites)"""
+
+    def __init__(self, threshold: int, cooldown: float, state_file: Optional[Path] = None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state_file = state_file
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        """Get or create the breaker for an extractor"""
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.threshold, self.cooldown, on_change=self.export)
+                self._breakers[name] = breaker
+            return breaker
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Get state of all breakers keyed by breaker name"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.to_dict() for breaker in breakers}
+
+    def export(self):
+        """Write breaker state to the state file for monitoring"""
+        if not self.state_file:
+            return
+
+        try:
+            with self._export_lock:
+                data = {'updated_at': time.time(), 'breakers': self.snapshot()}
+                tmp_file = Path(self.state_file).with_suffix('.tmp')
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2)
+                tmp_file.replace(self.state_file)
+        except OSError as e:
+            logger.error(f"Error exporting circuit breaker state: {e}")
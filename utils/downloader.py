@@ -1,8 +1,52 @@
 import os
 import yt_dlp
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Dict, List
-from config.settings import YTDLP_OPTIONS, DOWNLOAD_DIR, MAX_FILE_SIZE
+from typing import Optional, Dict, List, Tuple
+from urllib.parse import urlparse
+from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.utils import UnsupportedError
+from config.settings import (
+    YTDLP_OPTIONS,
+    DOWNLOAD_DIR,
+    MAX_FILE_SIZE,
+    NEGATIVE_CACHE_TTL,
+    CIRCUIT_BREAKER_THRESHOLD,
+    CIRCUIT_BREAKER_COOLDOWN,
+    CIRCUIT_BREAKER_STATE_FILE,
+)
+from utils.circuit_breaker import NegativeCache, CircuitBreakerRegistry
+
+
+# Callback data of the quality buttons
+QUALITY_CHOICES = ('quality_best', 'quality_medium', 'quality_low', 'quality_audio')
+
+
+class DownloadCancelled(Exception):
+    """Raised from a progress hook to abort a running download"""
+
+
+@lru_cache(maxsize=1024)
+def get_extractor_key(url: str) -> str:
+    """Get the name of the yt-dlp extractor that handles a URL"""
+    for extractor in gen_extractor_classes():
+        if extractor.suitable(url):
+            return extractor.ie_key()
+    return 'Generic'
+
+
+def get_breaker_key(url: str) -> str:
+    """
+    Get the name of the circuit breaker guarding a URL
+    
+    Sites without a dedicated extractor all use the Generic one, so they
+    get a breaker per hostname; otherwise one dead small site would
+    disable every other generic link too.
+    """
+    key = get_extractor_key(url)
+    if key == 'Generic':
+        return f"Generic:{urlparse(url).hostname}"
+    return key
 
 
 class VideoDownloader:
@@ -10,6 +54,12 @@ class VideoDownloader:
     
     def __init__(self):
         self.download_dir = DOWNLOAD_DIR
+        self.failed_urls = NegativeCache(NEGATIVE_CACHE_TTL)
+        self.breakers = CircuitBreakerRegistry(
+            CIRCUIT_BREAKER_THRESHOLD,
+            CIRCUIT_BREAKER_COOLDOWN,
+            state_file=CIRCUIT_BREAKER_STATE_FILE
+        )
     
     def extract_info(self, url: str) -> Optional[Dict]:
         """
@@ -20,7 +70,16 @@ class VideoDownloader:
         
         Returns:
             Video information dictionary or None if failed
+            (use get_failure to find out why)
         """
+        # Answer recently failed URLs and broken extractors without calling yt-dlp
+        if self.failed_urls.get(url):
+            return None
+        
+        breaker = self.breakers.get(get_breaker_key(url))
+        if not breaker.allow_request():
+            return None
+        
         ydl_opts = {
             'quiet': True,
             'no_warnings': True,
@@ -35,10 +94,72 @@ class VideoDownloader:
         try:
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=False)
-                return info
         except Exception as e:
             print(f"Error extracting info: {e}")
+            self.failed_urls.add(url, self._classify_error(e), str(e))
+            
+            # Errors about this URL alone (unsupported, private, removed, 404...)
+            # mean the extractor ran fine, so they don't count towards opening
+            # the breaker for everyone else
+            if self._is_extractor_failure(e):
+                breaker.record_failure(str(e))
+            else:
+                breaker.record_success()
             return None
+        
+        breaker.record_success()
+        return info
+    
+    def get_failure(self, url: str) -> Tuple[str, str]:
+        """
+        Get the reason extract_info failed for a URL
+        
+        Args:
+            url: Video URL
+        
+        Returns:
+            Tuple of (locale key, error message)
+        """
+        cached = self.failed_urls.get(url)
+        if cached:
+            return cached
+        
+        # Not cached, so the extractor's breaker rejected it
+        breaker = self.breakers.get(get_breaker_key(url))
+        if breaker.state != breaker.CLOSED:
+            return 'site_unavailable', ''
+        
+        return 'unsupported_site', ''
+    
+    @staticmethod
+    def _original_error(error: Exception) -> Exception:
+        """Get the extractor exception wrapped by a yt-dlp DownloadError"""
+        exc_info = getattr(error, 'exc_info', None)
+        return exc_info[1] if exc_info and exc_info[1] else error
+    
+    def _classify_error(self, error: Exception) -> str:
+        """Map a yt-dlp exception to a locale key"""
+        original = self._original_error(error)
+        
+        if isinstance(original, UnsupportedError) or 'Unsupported URL' in str(error):
+            return 'unsupported_site'
+        return 'error_occurred'
+    
+    def _is_extractor_failure(self, error: Exception) -> bool:
+        """Tell whether an error points at a broken extractor rather than a bad URL"""
+        original = self._original_error(error)
+        
+        # yt-dlp marks errors caused by the URL itself as expected
+        if isinstance(original, UnsupportedError) or getattr(original, 'expected', False):
+            return False
+        
+        # HTTP 4xx is about this URL, except rate limiting which hits every request
+        cause = getattr(original, 'cause', None)
+        status = getattr(cause, 'status', None) or getattr(cause, 'code', None)
+        if isinstance(status, int) and 400 <= status < 500 and status != 429:
+            return False
+        
+        return True
     
     def get_formats(self, url: str) -> Optional[List[Dict]]:
         """
@@ -77,7 +198,8 @@ class VideoDownloader:
         
         return filtered_formats
     
-    def download(self, url: str, format_id: str = None, progress_callback=None) -> Optional[str]:
+    def download(self, url: str, format_id: str = None, progress_callback=None,
+                 output_dir: Optional[Path] = None) -> Optional[str]:
         """
         Download video with proper aspect ratio preservation
         
@@ -85,11 +207,13 @@ class VideoDownloader:
             url: Video URL
             format_id: Specific format ID to download (optional)
             progress_callback: Callback function for download progress
+            output_dir: Directory to download into (optional)
         
         Returns:
             Path to downloaded file or None if failed
         """
         ydl_opts = YTDLP_OPTIONS.copy()
+        ydl_opts['outtmpl'] = self._outtmpl(output_dir)
         
         if format_id:
             ydl_opts['format'] = format_id
@@ -129,7 +253,7 @@ class VideoDownloader:
             print(f"Error downloading: {e}")
             return None
     
-    def download_best(self, url: str, progress_callback=None) -> Optional[str]:
+    def download_best(self, url: str, progress_callback=None, output_dir: Optional[Path] = None) -> Optional[str]:
         """
         Download best quality under file size limit
         Preserves original aspect ratio
@@ -137,24 +261,27 @@ class VideoDownloader:
         Args:
             url: Video URL
             progress_callback: Callback function for download progress
+            output_dir: Directory to download into (optional)
         
         Returns:
             Path to downloaded file or None if failed
         """
-        return self.download(url, format_id=None, progress_callback=progress_callback)
+        return self.download(url, format_id=None, progress_callback=progress_callback, output_dir=output_dir)
     
-    def download_medium(self, url: str, progress_callback=None) -> Optional[str]:
+    def download_medium(self, url: str, progress_callback=None, output_dir: Optional[Path] = None) -> Optional[str]:
         """
         Download medium quality (480p-720p) under file size limit
         
         Args:
             url: Video URL
             progress_callback: Callback function for download progress
+            output_dir: Directory to download into (optional)
         
         Returns:
             Path to downloaded file or None if failed
         """
         ydl_opts = YTDLP_OPTIONS.copy()
+        ydl_opts['outtmpl'] = self._outtmpl(output_dir)
         ydl_opts['format'] = '(bv*[height<=720][height>=480]+ba/b[height<=720][height>=480])[filesize<50M]/best[filesize<50M]'
         
         ydl_opts['http_headers'] = {
@@ -181,18 +308,20 @@ class VideoDownloader:
             print(f"Error downloading medium quality: {e}")
             return None
     
-    def download_low(self, url: str, progress_callback=None) -> Optional[str]:
+    def download_low(self, url: str, progress_callback=None, output_dir: Optional[Path] = None) -> Optional[str]:
         """
         Download low quality (360p or below) under file size limit
         
         Args:
             url: Video URL
             progress_callback: Callback function for download progress
+            output_dir: Directory to download into (optional)
         
         Returns:
             Path to downloaded file or None if failed
         """
         ydl_opts = YTDLP_OPTIONS.copy()
+        ydl_opts['outtmpl'] = self._outtmpl(output_dir)
         ydl_opts['format'] = '(bv*[height<=360]+ba/b[height<=360])[filesize<50M]/worst[filesize<50M]'
         
         ydl_opts['http_headers'] = {
@@ -219,18 +348,20 @@ class VideoDownloader:
             print(f"Error downloading low quality: {e}")
             return None
     
-    def download_audio(self, url: str, progress_callback=None) -> Optional[str]:
+    def download_audio(self, url: str, progress_callback=None, output_dir: Optional[Path] = None) -> Optional[str]:
         """
         Download audio only and convert to MP3
         
         Args:
             url: Video URL
             progress_callback: Callback function for download progress
+            output_dir: Directory to download into (optional)
         
         Returns:
             Path to downloaded file or None if failed
         """
         ydl_opts = YTDLP_OPTIONS.copy()
+        ydl_opts['outtmpl'] = self._outtmpl(output_dir)
         ydl_opts['format'] = 'bestaudio/best'
         ydl_opts['postprocessors'] = [{
             'key': 'FFmpegExtractAudio',
@@ -268,6 +399,39 @@ class VideoDownloader:
             print(f"Error downloading audio: {e}")
             return None
     
+    def download_choice(self, choice: str, url: str, progress_callback=None,
+                        output_dir: Optional[Path] = None) -> Optional[str]:
+        """
+        Download the quality selected with an inline button
+        
+        Args:
+            choice: One of QUALITY_CHOICES
+            url: Video URL
+            progress_callback: Callback function for download progress
+            output_dir: Directory to download into (optional)
+        
+        Returns:
+            Path to downloaded file or None if failed
+        """
+        downloads = {
+            'quality_best': self.download_best,
+            'quality_medium': self.download_medium,
+            'quality_low': self.download_low,
+            'quality_audio': self.download_audio,
+        }
+        
+        if choice not in downloads:
+            raise ValueError(f"Unknown quality choice: {choice}")
+        
+        return downloads[choice](url, progress_callback=progress_callback, output_dir=output_dir)
+    
+    @staticmethod
+    def _outtmpl(output_dir: Optional[Path]) -> str:
+        """Get the output template, placed inside output_dir if given"""
+        if not output_dir:
+            return YTDLP_OPTIONS['outtmpl']
+        return str(Path(output_dir) / Path(YTDLP_OPTIONS['outtmpl']).name)
+    
     def cleanup_file(self, filepath: str):
         """Delete downloaded file and any related files"""
         try:
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import re
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from utils.downloader import DownloadCancelled
+
+logger = logging.getLogger(__name__)
+
+# Partial files yt-dlp leaves behind: .part, .ytdl, fragments and unmerged formats
+PARTIAL_FILE_PATTERN = re.compile(r'\.(part|ytdl)$|\.part-Frag\d+|\.f\d+\.\w+$')
+
+
+class DownloadJob:
+    """A download requested by a user, tracked until its file is sent"""
+
+    def __init__(self, job_id: str, chat_id: int, url: str, choice: str, title: str,
+                 directory: Path, attempts: int = 0):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.url = url
+        self.choice = choice
+        self.title = title
+        self.directory = Path(directory)
+        self.attempts = attempts
+
+        self.completed = False
+        self.cancelled = threading.Event()
+        self.upload_task: Optional[asyncio.Task] = None
+
+    def progress_hook(self, d: Dict):
+        """yt-dlp progress hook that aborts the download on shutdown, keeping the .part file"""
+        if self.cancelled.is_set():
+            raise DownloadCancelled(self.url)
+
+    async def upload(self, coro) -> bool:
+        """
+        Run an upload so shutdown can interrupt it
+
+        Returns:
+            True if the upload finished, False if it was interrupted by shutdown
+        """
+        self.upload_task = asyncio.ensure_future(coro)
+        try:
+            await self.upload_task
+            return True
+        except asyncio.CancelledError:
+            if not self.cancelled.is_set():
+                raise
+            return False
+        finally:
+            self.upload_task = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'chat_id': self.chat_id,
+            'url': self.url,
+            'choice': self.choice,
+            'title': self.title,
+            'directory': str(self.directory),
+            'attempts': self.attempts,
+        }
+
+
+class JobManager:
+    """Track active downloads and journal them so they survive restarts"""
+
+    def __init__(self, journal_file: Path, jobs_dir: Path, max_attempts: int):
+        self.journal_file = Path(journal_file)
+        self.jobs_dir = Path(jobs_dir)
+        self.max_attempts = max_attempts
+        self.draining = False
+        self.active: Dict[str, DownloadJob] = {}
+        self._journal: Dict[str, Dict] = self._load()
+
+    def begin(self, chat_id: int, url: str, choice: str, title: str) -> DownloadJob:
+        """Start tracking a new download and record it in the journal"""
+        job_id = uuid.uuid4().hex
+        job = DownloadJob(job_id, chat_id, url, choice, title, self.jobs_dir / job_id)
+        self.active[job.id] = job
+        self._journal[job.id] = job.to_dict()
+        self._save()
+        return job
+
+    def adopt_directory(self, job: DownloadJob, directory: Path):
+        """Make a job continue in another directory, e.g. that of a promoted prefetch"""
+        shutil.rmtree(job.directory, ignore_errors=True)
+        job.directory = Path(directory)
+        self._journal[job.id] = job.to_dict()
+        self._save()
+
+    def resume(self) -> Tuple[List[DownloadJob], List[DownloadJob]]:
+        """
+        Get downloads left unfinished by the previous run
+
+        Only runs that ended without a clean shutdown (crashes) count as
+        attempts. Jobs that reached max_attempts are dropped along with
+        their files, and partial files no job refers to are deleted.
+
+        Returns:
+            Tuple of (jobs to run again, already tracked as active;
+            jobs given up on)
+        """
+        jobs = []
+        abandoned = []
+        for entry in list(self._journal.values()):
+            attempts = entry.get('attempts', 0)
+            job = DownloadJob(
+                entry['id'], entry['chat_id'], entry['url'], entry['choice'],
+                entry.get('title', ''),
+                Path(entry.get('directory') or self.jobs_dir / entry['id']),
+                attempts
+            )
+
+            if attempts >= self.max_attempts:
+                logger.warning(f"Giving up on download of {job.url} after {attempts} attempts")
+                del self._journal[job.id]
+                shutil.rmtree(job.directory, ignore_errors=True)
+                abandoned.append(job)
+                continue
+
+            # Counted up front so a crash during this run counts too;
+            # end() takes it back if the run is stopped by a clean shutdown
+            entry['attempts'] = attempts + 1
+            self.active[job.id] = job
+            jobs.append(job)
+
+        self._save()
+        self._sweep()
+        return jobs, abandoned
+
+    def end(self, job: DownloadJob):
+        """
+        Stop tracking a job
+
+        Jobs interrupted by shutdown before their file was sent stay in
+        the journal to be resumed on the next start; all others are
+        removed from it together with their directory.
+        """
+        self.active.pop(job.id, None)
+        if job.cancelled.is_set() and not job.completed:
+            # A clean shutdown isn't a failed attempt
+            self._journal[job.id] = job.to_dict()
+            self._save()
+            return
+
+        self._journal.pop(job.id, None)
+        self._save()
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    async def drain(self, timeout: float):
+        """
+        Stop active jobs for shutdown
+
+        Running downloads are interrupted straight away so their partial
+        files can be resumed later. Uploads get until the deadline to
+        finish and are interrupted after that.
+
+        Args:
+            timeout: Seconds to wait for uploads to finish
+        """
+        self.draining = True
+        logger.info(f"Draining {len(self.active)} active jobs")
+
+        for job in list(self.active.values()):
+            if job.upload_task is None:
+                job.cancelled.set()
+
+        deadline = time.time() + timeout
+        while self.active and time.time() < deadline:
+            await asyncio.sleep(0.5)
+
+        self.interrupt()
+
+        # Give interrupted jobs a moment to record their state
+        deadline = time.time() + 5
+        while self.active and time.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        logger.info(f"Drain finished, {len(self._journal)} jobs will resume on next start")
+
+    def interrupt(self):
+        """Interrupt every active download and upload right away"""
+        self.draining = True
+        for job in list(self.active.values()):
+            job.cancelled.set()
+            if job.upload_task:
+                job.upload_task.cancel()
+
+    def _sweep(self):
+        """Delete job directories and partial files no journal entry refers to"""
+        referenced = {
+            Path(entry['directory']).resolve()
+            for entry in self._journal.values() if entry.get('directory')
+        }
+
+        try:
+            if self.jobs_dir.exists():
+                for path in self.jobs_dir.iterdir():
+                    if path.resolve() in referenced:
+                        continue
+                    if path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink()
+
+            # Leftovers from before downloads had their own directories
+            for path in self.jobs_dir.parent.iterdir():
+                if path.is_file() and PARTIAL_FILE_PATTERN.search(path.name):
+                    path.unlink()
+        except OSError as e:
+            logger.error(f"Error removing abandoned partial files: {e}")
+
+    def _load(self) -> Dict[str, Dict]:
+        """Load the journal left by the previous run"""
+        if not self.journal_file.exists():
+            return {}
+
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                return {entry['id']: entry for entry in json.load(f)}
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error loading job journal: {e}")
+            return {}
+
+    def _save(self):
+        """Write the journal atomically so a crash never leaves it half written"""
+        try:
+            tmp_file = self.journal_file.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(list(self._journal.values()), f, ensure_ascii=False, indent=2)
+            tmp_file.replace(self.journal_file)
+        except OSError as e:
+            logger.error(f"Error saving job journal: {e}")
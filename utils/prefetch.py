@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Optional
+from utils.downloader import VideoDownloader, DownloadCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchJob:
+    """A speculative download started before the user picks a quality"""
+
+    def __init__(self, key: int, url: str, choice: str, directory: Path, max_bytes: int):
+        self.key = key
+        self.url = url
+        self.choice = choice
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.paused = False
+        self.promoted = threading.Event()
+        self.cancelled = threading.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.promoted_hook = None
+        self._bytes: Dict[str, int] = {}
+
+    def progress_hook(self, d: Dict):
+        """
+        yt-dlp progress hook that bounds the bandwidth spent on a guess
+
+        Once max_bytes have been fetched the download is stopped, keeping
+        its .part file so a promoted job can continue from there.
+        """
+        if self.cancelled.is_set():
+            raise DownloadCancelled(self.url)
+
+        if self.promoted.is_set():
+            if self.promoted_hook:
+                self.promoted_hook(d)
+            return
+
+        if d.get('status') != 'downloading':
+            return
+
+        self._bytes[d.get('tmpfilename') or d.get('filename')] = d.get('downloaded_bytes') or 0
+        if sum(self._bytes.values()) < self.max_bytes:
+            return
+
+        # Stop instead of waiting here, which would hold a worker thread
+        self.paused = True
+        raise DownloadCancelled(self.url)
+
+
+class SpeculativePrefetcher:
+    """Guess the quality a user will pick and start downloading it early"""
+
+    def __init__(self, downloader: VideoDownloader, jobs_dir: Path, default_choice: str,
+                 max_bytes: int, timeout: float):
+        self.downloader = downloader
+        self.jobs_dir = Path(jobs_dir)
+        self.default_choice = default_choice
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.stats: Dict[str, Counter] = defaultdict(Counter)
+        self.jobs: Dict[int, PrefetchJob] = {}
+
+    def predict(self, site: str) -> str:
+        """Get the quality most often selected for a site"""
+        counts = self.stats.get(site)
+        if counts:
+            return counts.most_common(1)[0][0]
+        return self.default_choice
+
+    def record_choice(self, site: str, choice: str):
+        """Remember which quality was selected for a site"""
+        if site:
+            self.stats[site][choice] += 1
+
+    def start(self, key: int, url: str, site: str) -> PrefetchJob:
+        """
+        Start prefetching the most likely quality for a URL
+
+        Args:
+            key: ID of the user the prefetch belongs to
+            url: Video URL
+            site: yt-dlp extractor key of the URL
+
+        Returns:
+            The started prefetch job
+        """
+        self.discard(key)
+
+        directory = self.jobs_dir / f"prefetch-{uuid.uuid4().hex}"
+        job = PrefetchJob(key, url, self.predict(site), directory, self.max_bytes)
+        job.task = asyncio.create_task(self._run(job))
+        self.jobs[key] = job
+        return job
+
+    def take(self, key: int, url: str, choice: str, progress_callback=None) -> Optional[PrefetchJob]:
+        """
+        Promote the prefetch if it matches the user's choice
+
+        A prefetch that doesn't match is cancelled and its files removed.
+        progress_callback is called for the rest of a promoted download.
+
+        Returns:
+            The promoted job to await, or None if there was no matching prefetch
+        """
+        job = self.jobs.get(key)
+        if job and job.url == url and job.choice == choice and not job.cancelled.is_set():
+            del self.jobs[key]
+            job.promoted_hook = progress_callback
+            job.promoted.set()
+            logger.info(f"Prefetch of {choice} promoted for {url}")
+            return job
+
+        self.discard(key)
+        return None
+
+    def discard(self, key: int):
+        """
+        Cancel the prefetch of a user
+
+        Doesn't wait for the download to stop; its files are removed once
+        it has.
+        """
+        job = self.jobs.pop(key, None)
+        if not job:
+            return
+
+        job.cancelled.set()
+        job.task.add_done_callback(lambda task: self._cleanup(job))
+
+    def discard_all(self):
+        """Cancel every prefetch that hasn't been promoted"""
+        for key in list(self.jobs):
+            self.discard(key)
+
+    async def _run(self, job: PrefetchJob) -> Optional[str]:
+        filepath = await asyncio.to_thread(
+            self.downloader.download_choice, job.choice, job.url, job.progress_hook, job.directory
+        )
+
+        # A failed guess is useless; the user's choice gets a fresh download
+        if not filepath and not job.paused and not job.promoted.is_set():
+            job.cancelled.set()
+
+        # A paused or finished prefetch only lives for PREFETCH_TIMEOUT if nobody claims it
+        deadline = time.time() + self.timeout
+        while not job.promoted.is_set() and not job.cancelled.is_set():
+            if time.time() >= deadline:
+                job.cancelled.set()
+                break
+            await asyncio.sleep(0.5)
+
+        if job.cancelled.is_set():
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            self._cleanup(job)
+            logger.info(f"Prefetch of {job.choice} cancelled for {job.url}")
+            return None
+
+        # Promoted after reaching the byte budget, continue from the .part file
+        if job.paused:
+            filepath = await asyncio.to_thread(
+                self.downloader.download_choice, job.choice, job.url, job.progress_hook, job.directory
+            )
+
+        return filepath
+
+    def _cleanup(self, job: PrefetchJob):
+        """Delete everything a cancelled prefetch wrote"""
+        shutil.rmtree(job.directory, ignore_errors=True)